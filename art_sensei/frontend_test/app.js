@@ -15,6 +15,7 @@ let websocket = null;
 let mediaRecorder = null;
 let audioChunks = [];
 let lastTranscript = ''; // Store last transcript for deduplication
+let streamingResponse = null; // AI response paragraph currently receiving streamed sentences
 const WS_URL = 'ws://localhost:8000/ws'; // Your FastAPI WebSocket URL
 
 function updateStatus(message) {
@@ -78,6 +79,25 @@ function displayAIResponse(message) {
     }
 }
 
+// Function to append a streamed sentence to the AI response in progress
+function appendAIResponseDelta(text) {
+    if (!streamingResponse) {
+        streamingResponse = document.createElement('p');
+        streamingResponse.textContent = 'ArtSensei: ' + text;
+        streamingResponse.style.color = '#006600'; // Green color for AI messages
+        streamingResponse.style.fontWeight = 'bold';
+        if (transcriptionDiv) {
+            transcriptionDiv.appendChild(streamingResponse);
+        }
+    } else {
+        streamingResponse.textContent += ' ' + text;
+    }
+    if (transcriptionDiv) {
+        // Auto-scroll
+        transcriptionDiv.scrollTop = transcriptionDiv.scrollHeight;
+    }
+}
+
 // Function to display error messages
 function displayError(message) {
     const p = document.createElement('p');
@@ -132,9 +152,18 @@ connectButton.onclick = () => {
                     console.log('AI Response:', message.text);
                     displayAIResponse('ArtSensei: ' + message.text);
                 }
+                else if (message.type === 'ai_response_delta') {
+                    // Next sentence of a streamed AI response
+                    appendAIResponseDelta(message.text);
+                }
+                else if (message.type === 'ai_response_end') {
+                    console.log('AI Response complete:', streamingResponse && streamingResponse.textContent);
+                    streamingResponse = null;
+                }
                 else if (message.type === 'error') {
                     console.error('Error from server:', message.text);
                     displayError('Error: ' + message.text);
+                    streamingResponse = null; // A failed stream won't send ai_response_end
                 }
                 else if (message.type === 'command') {
                     // Handle server commands
@@ -1,10 +1,9 @@
+import logging
 import os
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from dotenv import load_dotenv
 
-# Load .env file from the parent directory relative to src/
+# .env file in the parent directory relative to src/, read once by pydantic-settings
 dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env')
-load_dotenv(dotenv_path=dotenv_path)
 
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(
@@ -14,16 +13,28 @@ class Settings(BaseSettings):
     )
     google_api_key: str
     deepgram_api_key: str
+    log_level: str = "INFO" # Use WARNING in production to silence per-message logs
+    max_image_bytes: int = 20 * 1024 * 1024 # Largest image /analyze-image will download
+    # Server options used by `python -m src.main`
+    host: str = "127.0.0.1"
+    port: int = 8000
+    web_concurrency: int = os.cpu_count() or 2 # Number of uvicorn worker processes
 
     # Add other keys here later
 
 settings = Settings()
 
+logging.basicConfig(
+    level=settings.log_level.upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+logger = logging.getLogger(__name__)
+
 # Basic check
 if not settings.google_api_key:
     raise ValueError("GOOGLE_API_KEY must be set in the .env file")
 if not settings.deepgram_api_key:
     raise ValueError("DEEPGRAM_API_KEY must be set in the .env file")
 
-print(f"Loaded GOOGLE_API_KEY starting with: {settings.google_api_key[:4]}...") # Basic check
-print(f"Loaded DEEPGRAM_API_KEY starting with: {settings.deepgram_api_key[:4]}...") # Basic check
+logger.info("Loaded GOOGLE_API_KEY starting with: %s...", settings.google_api_key[:4]) # Basic check
+logger.info("Loaded DEEPGRAM_API_KEY starting with: %s...", settings.deepgram_api_key[:4]) # Basic check
@@ -2,67 +2,76 @@
 Handles conversation context management for ArtSensei
 Maintains the history of user inputs, AI responses, and images
 """
+from collections import deque
+from itertools import islice
+
+# Messages are stored as (role, content) tuples
+USER, ASSISTANT = 0, 1
+_ROLE_NAMES = ("User", "Assistant")
+
+IMAGE_PLACEHOLDER = "[User shared an image for analysis]"
+
+_PROMPT_TEMPLATE = """
+Previous conversation:
+{history}
+
+User's new question: {prompt}
+
+Please respond to the question in the context of our conversation.
+"""
+
 
 class ConversationContext:
     """Manages conversation context between the user and AI"""
-    
-    def __init__(self):
-        """Initialize an empty conversation history"""
-        self.messages = []
+
+    def __init__(self, max_messages=10):
+        """Initialize an empty conversation history holding at most max_messages"""
+        # Older messages fall off automatically, so memory stays bounded over long sessions
+        self.messages = deque(maxlen=max_messages)
         self.current_image = None
-    
+        # Each message's formatted line, plus their concatenation kept up to date as messages are added
+        self._lines = deque(maxlen=max_messages)
+        self._history = ""
+
+    def _append(self, role, content):
+        line = f"{_ROLE_NAMES[role]}: {content}\n"
+        if len(self._lines) == self._lines.maxlen:
+            # The oldest line is about to be evicted; drop it from the rendered history too
+            self._history = self._history[len(self._lines[0]):]
+        self.messages.append((role, content))
+        self._lines.append(line)
+        self._history += line
+
     def add_user_message(self, text):
         """Add a user text message to the conversation"""
-        self.messages.append({
-            "role": "user",
-            "content": text
-        })
-    
+        self._append(USER, text)
+
     def add_image_message(self, image_data_url):
         """Add an image message to the conversation"""
         # Store the current image being discussed
         self.current_image = image_data_url
-        
+
         # Also add to the messages to maintain context
-        self.messages.append({
-            "role": "user",
-            "content": "[User shared an image for analysis]"
-        })
-    
+        self._append(USER, IMAGE_PLACEHOLDER)
+
     def add_ai_response(self, text):
         """Add an AI response to the conversation"""
-        self.messages.append({
-            "role": "assistant",
-            "content": text
-        })
-    
-    def get_conversation_history(self, max_messages=10):
+        self._append(ASSISTANT, text)
+
+    def get_conversation_history(self, max_messages=None):
         """Get recent conversation history as a formatted string"""
+        if max_messages is None or max_messages >= len(self._lines):
+            return self._history
+
         # Get the most recent messages, limited to max_messages
-        recent_messages = self.messages[-max_messages:] if len(self.messages) > max_messages else self.messages
-        
-        # Format the conversation for Gemini prompt
-        formatted_conversation = ""
-        for msg in recent_messages:
-            role = "User" if msg["role"] == "user" else "Assistant"
-            formatted_conversation += f"{role}: {msg['content']}\n"
-        
-        return formatted_conversation
-    
+        return "".join(islice(self._lines, len(self._lines) - max_messages, None))
+
     def get_prompt_with_context(self, prompt, include_image=False):
         """Create a prompt that includes conversation history"""
         context = self.get_conversation_history()
-        
-        if context:
-            final_prompt = f"""
-Previous conversation:
-{context}
-
-User's new question: {prompt}
 
-Please respond to the question in the context of our conversation.
-"""
-            return final_prompt
+        if context:
+            return _PROMPT_TEMPLATE.format_map({"history": context, "prompt": prompt})
         else:
             # No history yet
             return prompt
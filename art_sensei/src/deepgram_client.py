@@ -1,6 +1,5 @@
 import asyncio
-from dotenv import load_dotenv
-import os
+import logging
 from deepgram import (
     DeepgramClient,
     DeepgramClientOptions,
@@ -8,23 +7,33 @@ from deepgram import (
     LiveOptions,
 )
 
-# Load environment variables (if using .env file)
-load_dotenv()
+from .config import settings
 
-API_KEY = os.getenv("DEEPGRAM_API_KEY")
+logger = logging.getLogger(__name__)
 
 # URL for the realtime streaming audio endpoint
 URL = "wss://api.deepgram.com/v1/listen"
 
+# How long to wait for Deepgram's Open event after starting a connection
+OPEN_TIMEOUT = 2.0
+
 class DeepgramConnection:
     def __init__(self, transcript_callback=None):
         self.config: DeepgramClientOptions = DeepgramClientOptions(
-            verbose=False # Set to True for detailed logs from SDK
+            verbose=False, # Set to True for detailed logs from SDK
+            # Send KeepAlive messages so idle (pre-warmed) connections aren't dropped
+            options={"keepalive": "true"},
         )
-        self.deepgram: DeepgramClient = DeepgramClient(API_KEY, self.config)
+        self.deepgram: DeepgramClient = DeepgramClient(settings.deepgram_api_key, self.config)
         self.dg_connection = None
         self.is_connected = False
         self.transcript_callback = transcript_callback # Store the callback
+        self._final_parts = [] # is_final segments of the utterance in progress
+        self._ready = asyncio.Event() # Set once Deepgram reports the connection open
+        # Audio received while a send is in flight is coalesced and sent as one frame
+        self._audio_buffer = bytearray()
+        self._audio_pending = asyncio.Event()
+        self._flush_task = None
 
     async def connect(self):
         options: LiveOptions = LiveOptions(
@@ -43,7 +52,8 @@ class DeepgramConnection:
         )
 
         try:
-            print("Attempting to connect to Deepgram...")
+            logger.info("Attempting to connect to Deepgram...")
+            self._ready.clear()
             self.dg_connection = self.deepgram.listen.asyncwebsocket.v("1")
             # Setup event listeners
             self.dg_connection.on(LiveTranscriptionEvents.Open, self.on_open)
@@ -56,72 +66,183 @@ class DeepgramConnection:
 
             # Start the connection
             await self.dg_connection.start(options)
-            print("Deepgram connection established (waiting for Open event).")
+            logger.info("Deepgram connection established (waiting for Open event).")
 
 
         except Exception as e:
-            print(f"Could not open Deepgram connection: {e}")
+            logger.error("Could not open Deepgram connection: %s", e)
             self.is_connected = False
 
     async def on_open(self, *args, **kwargs):
         # print(f"\n\n-- Connection Open (Simplified) -- Args: {args}, Kwargs: {kwargs}\n\n")
         self.is_connected = True
+        self._ready.set()
+
+    async def wait_until_ready(self, timeout=OPEN_TIMEOUT):
+        """Wait for the Open event instead of sleeping; returns whether the connection is usable."""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Deepgram connection not open after %ss.", timeout)
+        return self.is_connected
 
     async def on_message(self, sender, result, **kwargs):
         sentence = result.channel.alternatives[0].transcript
+        if result.is_final and sentence:
+            self._final_parts.append(sentence)
+
+        # speech_final marks the end of the utterance: hand over the whole thing once
+        if result.speech_final:
+            await self._flush_utterance()
+            return
+
         if len(sentence) == 0:
             return
-        # print(f"Speaker: {sentence}")
+        # Interim update: the finalized segments so far plus the current guess
+        parts = self._final_parts if result.is_final else self._final_parts + [sentence]
+        await self._send_transcript(" ".join(parts), False)
+
+    async def _flush_utterance(self):
+        utterance = " ".join(self._final_parts)
+        self._final_parts = []
+        if utterance:
+            await self._send_transcript(utterance, True)
+
+    async def _send_transcript(self, transcript, is_final):
         if self.transcript_callback:
-            print(f"Sending transcript via callback: {sentence}")
+            logger.debug("Sending transcript via callback (final=%s): %s", is_final, transcript)
             # Use await if the callback is an async function
-            await self.transcript_callback(sentence) 
+            await self.transcript_callback(transcript, is_final)
         else:
-             print("Transcript received, but no callback set.")
+             logger.debug("Transcript received, but no callback set.")
 
     async def on_metadata(self, sender, metadata, **kwargs):
-        print(f"\n\n-- Metadata --\nSender: {sender} Metadata: {metadata}\n\n")
+        logger.debug("Metadata: %s", metadata)
 
     async def on_speech_started(self, sender, speech_started, **kwargs):
-        print(f"\n\n-- Speech Started --\nSender: {sender} Data: {speech_started}\n\n")
+        logger.debug("Speech started: %s", speech_started)
 
     async def on_utterance_end(self, sender, utterance_end, **kwargs):
-        print(f"\n\n-- Utterance End --\nSender: {sender} Data: {utterance_end}\n\n")
+        logger.debug("Utterance end: %s", utterance_end)
+        # Fallback for when speech_final never arrived (e.g. background noise)
+        await self._flush_utterance()
 
     async def on_error(self, sender, error, **kwargs):
-        print(f"\n\n-- Error --\n{error}\n\n")
+        logger.error("Deepgram error: %s", error)
         self.is_connected = False # Assume connection is lost on error
+        self._ready.clear()
 
     async def on_close(self, sender, **kwargs):
-        print(f"\n\n-- Connection Closed --\nSender: {sender} Kwargs: {kwargs}\n\n")
+        logger.info("Deepgram connection closed: %s", kwargs)
         self.is_connected = False
+        self._ready.clear()
 
     async def send_audio(self, audio_chunk):
+        """Queue audio for Deepgram; chunks that arrive while a send is in flight go out together"""
+        self._audio_buffer.extend(audio_chunk)
+        self._audio_pending.set()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await self._audio_pending.wait()
+            self._audio_pending.clear()
+            audio = bytes(self._audio_buffer)
+            self._audio_buffer.clear()
+            await self._send_now(audio)
+
+    async def _send_now(self, audio_chunk):
         # If connection isn't active, try to reconnect
         if not self.is_connected or not self.dg_connection:
-            print("Attempting to reconnect to Deepgram before sending audio...")
+            logger.info("Attempting to reconnect to Deepgram before sending audio...")
             await self.connect()
-            # Give a moment for connection to establish
-            await asyncio.sleep(0.5)
-            
+            # Wait for the Open event rather than a fixed delay
+            await self.wait_until_ready()
+
         # Check again after reconnection attempt
         if self.is_connected and self.dg_connection:
             try:
                 await self.dg_connection.send(audio_chunk)
                 return True
             except Exception as e:
-                print(f"Error sending audio to Deepgram: {e}")
+                logger.error("Error sending audio to Deepgram: %s", e)
                 self.is_connected = False
                 return False
         else:
-            print("Cannot send audio: Deepgram connection still not active after reconnection attempt.")
+            logger.warning("Cannot send audio: Deepgram connection still not active after reconnection attempt.")
             return False
 
     async def finish(self):
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        self._audio_buffer.clear()
         if self.dg_connection:
             await self.dg_connection.finish()
-            print("Deepgram connection finished.")
+            logger.info("Deepgram connection finished.")
         self.is_connected = False
+        self._ready.clear()
+
+
+class DeepgramConnectionPool:
+    """Keeps pre-opened Deepgram connections so new clients skip the handshake"""
+
+    def __init__(self, size=1):
+        self.size = size
+        self._idle = []
+        self._refill_task = None
+
+    async def start(self):
+        """Open the initial idle connections (call from the app lifespan)"""
+        await self._refill()
+
+    async def _refill(self):
+        while len(self._idle) < self.size:
+            conn = DeepgramConnection()
+            try:
+                await conn.connect()
+                ready = await conn.wait_until_ready()
+            except asyncio.CancelledError:
+                # Cancelled by close() mid-handshake; don't leak the half-open connection
+                await conn.finish()
+                raise
+            if not ready:
+                await conn.finish()
+                logger.warning("Could not pre-warm a Deepgram connection.")
+                return
+            self._idle.append(conn)
+
+    async def acquire(self, transcript_callback=None):
+        """Hand out an open connection if one is idle, otherwise open a new one"""
+        conn = None
+        while self._idle:
+            candidate = self._idle.pop()
+            if candidate.is_connected:
+                conn = candidate
+                break
+            await candidate.finish()
+
+        if conn is None:
+            conn = DeepgramConnection()
+            await conn.connect()
+        conn.transcript_callback = transcript_callback
+
+        # Replace the connection we just handed out in the background
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+        return conn
+
+    async def close(self):
+        """Cancel any pending refill and close idle connections"""
+        if self._refill_task:
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except asyncio.CancelledError:
+                pass
+        while self._idle:
+            await self._idle.pop().finish()
 
 
 async def start_deepgram_connection(transcript_callback=None):
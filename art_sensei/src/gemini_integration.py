@@ -1,54 +1,260 @@
+import asyncio
+import base64
+import hashlib
+import logging
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
 import google.generativeai as genai
-import requests
+from google.api_core import exceptions as google_exceptions
 from .config import settings
 
+logger = logging.getLogger(__name__)
+
 genai.configure(api_key=settings.google_api_key)
 
 # Use a model suitable for text generation (e.g., gemini-1.5-flash or gemini-pro)
 # Using flash as it's generally faster and cheaper for simpler tasks
 model = genai.GenerativeModel('gemini-1.5-flash-latest')
 
+# Header of a base64 data URL, e.g. "data:image/jpeg;base64,"; the payload follows the match
+_DATA_URL_RE = re.compile(r'data:([^;,]+);base64,')
+
+# Prompt used when the user shares an image without a question
+_IMAGE_ANALYSIS_PROMPT = "Analyze this artwork. Describe the style, techniques used, possible period, and artistic elements you observe."
+
+UNAVAILABLE_MESSAGE = "Sorry, the analysis service is temporarily unavailable. Please try again shortly."
+
+# Rate limits and transient server errors (429/500/503/504) are retried with backoff
+_RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+)
+MAX_ATTEMPTS = 3
+RETRY_INITIAL_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Gemini while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Fails fast after repeated transient Gemini failures
+
+    After fail_max consecutive failures the circuit opens and calls are rejected for
+    reset_timeout seconds; then a single trial call is let through, which closes the
+    circuit on success or re-opens it on failure.
+    """
+
+    def __init__(self, fail_max=5, reset_timeout=30.0):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        # Sync Gemini calls run on worker threads
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError("Gemini circuit breaker is open")
+            # Half-open: let this call through and keep rejecting others until it finishes
+            self._opened_at = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.fail_max:
+                if self._opened_at is None:
+                    logger.error("Gemini circuit breaker opened after %d failures", self._failures)
+                self._opened_at = time.monotonic()
+
+
+_breaker = CircuitBreaker()
+
+
+class AnalysisCache:
+    """Thread-safe LRU cache with a TTL for image analysis results
+
+    Keys combine a hash of the image bytes with the prompt, so the same picture hits the
+    cache no matter how it was sent (URL or upload).
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict() # key -> (expires_at, result)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(image_data, prompt):
+        return hashlib.blake2b(image_data, digest_size=16).digest(), prompt
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                result = entry[1]
+            else:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                result = None
+            logger.debug("Analysis cache %s (hits=%d, misses=%d)",
+                         "hit" if result is not None else "miss", self.hits, self.misses)
+            return result
+
+    def put(self, key, result):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+_analysis_cache = AnalysisCache()
+
+
+def _backoff_delay(attempt):
+    """Exponential backoff with jitter for the given (1-based) failed attempt"""
+    return min(RETRY_MAX_DELAY, RETRY_INITIAL_DELAY * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+
+
+def _generate_content(contents):
+    """model.generate_content with retries on transient errors, behind the circuit breaker"""
+    _breaker.before_call()
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            response = model.generate_content(contents)
+        except _RETRYABLE_ERRORS as e:
+            if attempt == MAX_ATTEMPTS:
+                _breaker.record_failure()
+                raise
+            logger.warning("Transient Gemini error (attempt %d/%d): %s", attempt, MAX_ATTEMPTS, e)
+            time.sleep(_backoff_delay(attempt))
+        except google_exceptions.GoogleAPICallError:
+            # Gemini answered (e.g. InvalidArgument for a bad image), so the service is reachable
+            _breaker.record_success()
+            raise
+        else:
+            _breaker.record_success()
+            return response
+
+
+async def _generate_content_async(contents, **kwargs):
+    """Async counterpart of _generate_content"""
+    _breaker.before_call()
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            response = await model.generate_content_async(contents, **kwargs)
+        except _RETRYABLE_ERRORS as e:
+            if attempt == MAX_ATTEMPTS:
+                _breaker.record_failure()
+                raise
+            logger.warning("Transient Gemini error (attempt %d/%d): %s", attempt, MAX_ATTEMPTS, e)
+            await asyncio.sleep(_backoff_delay(attempt))
+        except google_exceptions.GoogleAPICallError:
+            # Gemini answered (e.g. InvalidArgument for a bad image), so the service is reachable
+            _breaker.record_success()
+            raise
+        else:
+            _breaker.record_success()
+            return response
+
+
 def analyze_text_with_gemini(text: str) -> str:
     """Analyzes the given text using a Gemini text model."""
     try:
-        response = model.generate_content(text)
+        response = _generate_content(text)
         # Basic error check within response if needed (depends on library)
         if response.text:
             return response.text
         else:
             # Handle cases where response might be empty or blocked
             # Check response.prompt_feedback for safety ratings/blocks
-            print(f"Gemini Warning/Error: {response.prompt_feedback}")
+            logger.warning("Gemini Warning/Error: %s", response.prompt_feedback)
             return "Sorry, I couldn't process that request due to content restrictions."
 
+    except CircuitOpenError:
+        return UNAVAILABLE_MESSAGE
     except Exception as e:
-        print(f"Error interacting with Gemini API: {e}")
+        logger.error("Error interacting with Gemini API: %s", e)
         # Consider raising a more specific exception or returning a standard error message
         return "Sorry, there was an error communicating with the analysis service."
 
 
-def analyze_image_and_text_with_gemini(text: str, image_url: str) -> str:
-    """Analyzes the given text and image URL using the Gemini Vision model."""
+async def stream_text_with_gemini(text: str):
+    """Streams Gemini's analysis of the given text, yielding text chunks as they are generated.
+
+    Raises if the stream fails after text has already been yielded, so callers can
+    tell a truncated response from a complete one.
+    """
+    produced = False
+    try:
+        response = await _generate_content_async(text, stream=True)
+        async for chunk in response:
+            # A blocked prompt comes back with no candidates (and .parts/.text would raise)
+            if chunk.candidates and chunk.parts:
+                produced = True
+                yield chunk.text
+
+        if not produced:
+            logger.warning("Gemini Warning/Error: %s", response.prompt_feedback)
+            yield "Sorry, I couldn't process that request due to content restrictions."
+
+    except CircuitOpenError:
+        yield UNAVAILABLE_MESSAGE
+    except Exception as e:
+        logger.error("Error streaming from Gemini API: %s", e)
+        if produced:
+            raise
+        yield "Sorry, there was an error communicating with the analysis service."
+
+
+def analyze_image_and_text_with_gemini(text: str, image_data: bytes, mime_type: str = "image/jpeg") -> str:
+    """Analyzes the given text and image bytes using the Gemini Vision model."""
     try:
-        # Gemini Vision API can often take URLs directly
-        # If this fails, we might need to download the image bytes first
+        cache_key = AnalysisCache.key(image_data, text)
+        cached = _analysis_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         image_part = {
-            "mime_type": "image/jpeg", # Assuming JPEG based on URL, might need detection
-            "data": requests.get(image_url, stream=True).content
+            "mime_type": mime_type,
+            "data": image_data
         }
         # Construct the prompt content
         contents = [text, image_part]
 
-        response = model.generate_content(contents)
+        response = _generate_content(contents)
 
         if response.text:
+            _analysis_cache.put(cache_key, response.text)
             return response.text
         else:
-            print(f"Gemini Vision Warning/Error: {response.prompt_feedback}")
+            logger.warning("Gemini Vision Warning/Error: %s", response.prompt_feedback)
             return "Sorry, I couldn't analyze the image due to content restrictions or other issues."
 
+    except CircuitOpenError:
+        return UNAVAILABLE_MESSAGE
     except Exception as e:
-        print(f"Error interacting with Gemini Vision API: {e}")
+        logger.error("Error interacting with Gemini Vision API: %s", e)
         return "Sorry, there was an error communicating with the image analysis service."
 
 
@@ -56,20 +262,19 @@ def analyze_image_from_data_url(data_url: str) -> str:
     """Analyzes an image provided as a data URL using the Gemini Vision model."""
     try:
         # Extract data from the data URL - typical format: data:image/jpeg;base64,BASE64_DATA
-        if not data_url.startswith('data:'):
+        # Only the short header is matched; the (large) payload is never scanned in Python
+        match = _DATA_URL_RE.match(data_url)
+        if not match:
             return "Invalid data URL format."
-            
-        # Simple extraction of mime type and data
-        mime_type = data_url.split(';')[0].split(':')[1]
-        
-        # Extract the base64 data part after the comma
-        base64_data = data_url.split(',')[1]
+        mime_type = match.group(1)
         
-        # Import the base64 library here to avoid global import if not needed elsewhere
-        import base64
-        
-        # Decode the base64 data
-        image_data = base64.b64decode(base64_data)
+        # Decode the base64 data after the header
+        image_data = base64.b64decode(data_url[match.end():])
+
+        cache_key = AnalysisCache.key(image_data, _IMAGE_ANALYSIS_PROMPT)
+        cached = _analysis_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
         # Create the image part for Gemini
         image_part = {
@@ -77,19 +282,19 @@ def analyze_image_from_data_url(data_url: str) -> str:
             "data": image_data
         }
         
-        # Create a prompt asking for art analysis
-        prompt = "Analyze this artwork. Describe the style, techniques used, possible period, and artistic elements you observe."
-        
-        # Send to Gemini
-        contents = [prompt, image_part]
-        response = model.generate_content(contents)
+        # Send to Gemini with the art analysis prompt
+        contents = [_IMAGE_ANALYSIS_PROMPT, image_part]
+        response = _generate_content(contents)
         
         if response.text:
+            _analysis_cache.put(cache_key, response.text)
             return response.text
         else:
-            print(f"Gemini Vision Warning/Error: {response.prompt_feedback}")
+            logger.warning("Gemini Vision Warning/Error: %s", response.prompt_feedback)
             return "Sorry, I couldn't analyze the image due to content restrictions or other issues."
             
+    except CircuitOpenError:
+        return UNAVAILABLE_MESSAGE
     except Exception as e:
-        print(f"Error analyzing image from data URL: {e}")
+        logger.error("Error analyzing image from data URL: %s", e)
         return f"Sorry, there was an error analyzing the image: {str(e)}"
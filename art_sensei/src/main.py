@@ -1,13 +1,102 @@
 import asyncio
-import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import httpx
+import orjson
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from .gemini_integration import analyze_text_with_gemini, analyze_image_and_text_with_gemini, analyze_image_from_data_url
-from .deepgram_client import DeepgramConnection
+from .config import settings
+from .gemini_integration import analyze_text_with_gemini, analyze_image_and_text_with_gemini, analyze_image_from_data_url, stream_text_with_gemini
+from .deepgram_client import DeepgramConnectionPool
 from .conversation_context import ConversationContext
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+try:
+    # libuv-backed event loop; not available on Windows, where asyncio's default loop is used
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
+
+async def run_gemini(func, *args):
+    """Run a blocking Gemini call on the Gemini thread pool created in lifespan"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(app.state.gemini_executor, func, *args)
+
+# One idle Deepgram connection is kept open so a new client doesn't pay the handshake
+deepgram_pool = DeepgramConnectionPool(size=1)
+
+IMAGE_FETCH_TIMEOUT = 10.0
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Blocking Gemini SDK calls get their own bounded pool, so a slow Gemini request
+    # can't starve the default executor used by everything else
+    app.state.gemini_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="gemini")
+    # Shared async HTTP client: pooled keep-alive connections for image fetches
+    app.state.http = httpx.AsyncClient(
+        timeout=httpx.Timeout(IMAGE_FETCH_TIMEOUT),
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        follow_redirects=True,
+    )
+    await deepgram_pool.start()
+    yield
+    await deepgram_pool.close()
+    await app.state.http.aclose()
+    app.state.gemini_executor.shutdown(wait=False, cancel_futures=True)
+
+app = FastAPI(lifespan=lifespan)
+
+_HTTP_PREFIXES = ("http://", "https://")
+
+# Split streamed AI text after sentence-ending punctuation
+_SENTENCE_BREAK_RE = re.compile(r'(?<=[.!?])\s+')
+
+def sniff_image_mime(data: bytes):
+    """Identify common image formats from their magic bytes, or return None"""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return None
+
+async def fetch_image(client: httpx.AsyncClient, url: str):
+    """Download an image, returning its bytes and MIME type
+
+    The body is streamed so non-images and images over settings.max_image_bytes are
+    rejected without buffering them. The MIME type comes from the image's magic bytes,
+    falling back to the Content-Type header, so generically typed downloads still work.
+    """
+    async with client.stream("GET", url) as response:
+        response.raise_for_status()
+
+        declared_type = response.headers.get("Content-Type", "").split(";", 1)[0].strip().lower()
+        if declared_type and not declared_type.startswith("image/") and declared_type != "application/octet-stream":
+            raise HTTPException(status_code=415, detail="image_url does not point to an image")
+
+        declared_size = response.headers.get("Content-Length", "")
+        if declared_size.isdigit() and int(declared_size) > settings.max_image_bytes:
+            raise HTTPException(status_code=413, detail="Image is too large")
+
+        image_data = bytearray()
+        async for chunk in response.aiter_bytes(65536):
+            image_data.extend(chunk)
+            if len(image_data) > settings.max_image_bytes:
+                raise HTTPException(status_code=413, detail="Image is too large")
+
+    mime_type = sniff_image_mime(image_data) or (declared_type if declared_type.startswith("image/") else None)
+    if mime_type is None:
+        raise HTTPException(status_code=415, detail="image_url does not point to an image")
+    return bytes(image_data), mime_type
 
 class TextAnalysisRequest(BaseModel):
     text: str
@@ -30,13 +119,31 @@ async def analyze_text_endpoint(request: TextAnalysisRequest):
         raise HTTPException(status_code=400, detail="Text cannot be empty")
 
     try:
-        analysis_result = analyze_text_with_gemini(request.text)
+        analysis_result = await run_gemini(analyze_text_with_gemini, request.text)
         return TextAnalysisResponse(analysis=analysis_result)
     except Exception as e:
         # Catch potential errors from the gemini module if not handled there
-        print(f"Error during text analysis endpoint: {e}")
+        logger.error("Error during text analysis endpoint: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error during analysis")
 
+@app.post("/analyze-text/stream")
+async def analyze_text_stream_endpoint(request: TextAnalysisRequest):
+    """Receives text and streams Gemini's analysis as server-sent events."""
+    if not request.text:
+        raise HTTPException(status_code=400, detail="Text cannot be empty")
+
+    async def events():
+        try:
+            async for chunk in stream_text_with_gemini(request.text):
+                yield f"data: {orjson.dumps({'text': chunk}).decode()}\n\n"
+        except Exception:
+            # The stream broke after partial output; tell the client it is incomplete
+            yield "event: error\ndata: Error generating analysis\n\n"
+            return
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 @app.post("/analyze-image", response_model=TextAnalysisResponse)
 async def analyze_image_endpoint(request: ImageAnalysisRequest):
     """Receives text and an image URL, returns Gemini's analysis."""
@@ -44,94 +151,146 @@ async def analyze_image_endpoint(request: ImageAnalysisRequest):
         raise HTTPException(status_code=400, detail="Text and image_url cannot be empty")
 
     # Basic URL validation (can be improved)
-    if not request.image_url.startswith(("http://", "https://")):
+    if not request.image_url.startswith(_HTTP_PREFIXES):
+        raise HTTPException(status_code=400, detail="Invalid image_url format")
+
+    try:
+        image_data, mime_type = await fetch_image(app.state.http, request.image_url)
+    except httpx.InvalidURL:
+        # Not an httpx.HTTPError; raised for URLs that pass the prefix check but don't parse
         raise HTTPException(status_code=400, detail="Invalid image_url format")
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail="Timed out fetching image_url")
+    except httpx.HTTPError as e:
+        logger.warning("Could not fetch image %s: %s", request.image_url, e)
+        raise HTTPException(status_code=502, detail="Could not fetch image_url")
 
     try:
-        analysis_result = analyze_image_and_text_with_gemini(request.text, request.image_url)
+        analysis_result = await run_gemini(analyze_image_and_text_with_gemini, request.text, image_data, mime_type)
         return TextAnalysisResponse(analysis=analysis_result)
     except Exception as e:
-        print(f"Error during image analysis endpoint: {e}")
+        logger.error("Error during image analysis endpoint: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error during image analysis")
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    print("\n\n*** NEW WEBSOCKET CLIENT CONNECTING ***\n\n")
     await websocket.accept()
-    print(f"\n\n*** WEBSOCKET CLIENT CONNECTED: {websocket.client} ***\n\n")
+    logger.info("WebSocket client connected: %s", websocket.client)
     
     # Create a conversation context for this client
     conversation = ConversationContext()
 
-    # Track the last complete transcript for this session to avoid duplicates
-    last_transcript = ""
-    
-    async def send_transcript_to_client(transcript: str):
-        nonlocal last_transcript
+    # Outgoing messages are queued and written by a single sender task, so producers
+    # (Deepgram callbacks, Gemini responses) never wait on the socket
+    outbox = asyncio.Queue()
+
+    async def sender():
         try:
-            print(f"Received transcription from Deepgram: {transcript}")
-            # Send the transcription to the client - frontend will handle display deduplication
-            await websocket.send_text(json.dumps({"type": "transcription", "text": transcript}))
-            
-            # Only add to conversation context if this appears to be a complete thought
-            # Check for sentence-ending punctuation or if it's at least 3 words longer than last transcript
-            is_complete = any(transcript.rstrip().endswith(p) for p in ['.', '?', '!']) or \
-                         (len(transcript.split()) >= len(last_transcript.split()) + 3)
-            
-            # Check for duplicates more thoroughly
-            # It's a duplicate if:
-            # 1. It's identical to the last transcript (case-insensitive).
-            # 2. It starts with the last transcript and only adds 1-2 words (likely an extension).
-            starts_with_last = last_transcript and transcript.lower().startswith(last_transcript.lower())
-            word_diff = len(transcript.split()) - len(last_transcript.split()) if last_transcript else len(transcript.split())
-
-            is_duplicate = transcript.lower() == last_transcript.lower() or \
-                          (starts_with_last and word_diff <= 2 and word_diff > 0)
-
-            if is_complete and not is_duplicate:
-                # This seems like a complete thought that's worth responding to
-                print(f"Adding to conversation context: {transcript}")
-                
-                # Add the transcript to conversation context
-                conversation.add_user_message(transcript)
-                last_transcript = transcript
-                
-                # Get AI response to the transcript using conversation context
-                try:
-                    contextual_prompt = conversation.get_prompt_with_context(transcript)
-                    ai_response = analyze_text_with_gemini(contextual_prompt)
-                    print(f"AI response: {ai_response}")
-                    
-                    # Add AI response to conversation context
-                    conversation.add_ai_response(ai_response)
-                    
-                    # Send AI response back to client
-                    await websocket.send_text(json.dumps({"type": "ai_response", "text": ai_response}))
-                except Exception as e:
-                    print(f"Error generating AI response: {e}")
-                    await websocket.send_text(json.dumps({"type": "error", "text": "Error generating AI response"}))
-            else:
-                print(f"Skipping incomplete or duplicate transcript: {transcript}")
-                
+            while True:
+                message = await outbox.get()
+                await websocket.send_text(message)
         except WebSocketDisconnect:
-            print(f"Client {websocket.client} disconnected before transcript could be sent.")
+            logger.info("Client %s disconnected before queued messages could be sent.", websocket.client)
         except Exception as e:
-            print(f"Error sending transcript to client {websocket.client}: {e}")
+            logger.error("Error sending message to client %s: %s", websocket.client, e)
 
-    dg_connection = DeepgramConnection(transcript_callback=send_transcript_to_client)
-    
-    try:
-        print(f"Establishing Deepgram connection for {websocket.client}...")
-        await dg_connection.connect() 
+    def send_json(payload):
+        outbox.put_nowait(orjson.dumps(payload).decode())
+
+    sender_task = asyncio.create_task(sender())
+
+    # Finalized utterances waiting for an AI reply. One responder task answers them in
+    # order, so Deepgram's callback returns immediately and transcripts keep coming
+    utterances = asyncio.Queue()
+
+    async def send_transcript_to_client(transcript: str, is_final: bool):
+        try:
+            logger.debug("Received transcription from Deepgram: %s", transcript)
+            # Send the transcription to the client - frontend will handle display deduplication
+            send_json({"type": "transcription", "text": transcript, "is_final": is_final})
+
+            # Only respond once Deepgram has finalized the whole utterance
+            if is_final:
+                utterances.put_nowait(transcript)
+
+        except Exception as e:
+            logger.error("Error sending transcript to client %s: %s", websocket.client, e)
+
+    async def respond_to_utterances():
+        while True:
+            transcript = await utterances.get()
+            logger.info("Adding to conversation context: %s", transcript)
+
+            # Add the transcript to conversation context
+            conversation.add_user_message(transcript)
+
+            # Stream the AI response to the client sentence by sentence as Gemini generates it
+            try:
+                contextual_prompt = conversation.get_prompt_with_context(transcript)
+                response_parts = []
+                pending = ""
+                async for chunk in stream_text_with_gemini(contextual_prompt):
+                    response_parts.append(chunk)
+                    *sentences, pending = _SENTENCE_BREAK_RE.split(pending + chunk)
+                    for sentence in sentences:
+                        send_json({"type": "ai_response_delta", "text": sentence})
+                if pending.strip():
+                    send_json({"type": "ai_response_delta", "text": pending})
+                send_json({"type": "ai_response_end"})
+
+                ai_response = "".join(response_parts)
+                logger.info("AI response: %s", ai_response)
 
-        await asyncio.sleep(0.5) 
+                # Add AI response to conversation context
+                conversation.add_ai_response(ai_response)
+            except Exception as e:
+                # The partial reply is not added to the conversation context
+                logger.error("Error generating AI response: %s", e)
+                send_json({"type": "error", "text": "Error generating AI response"})
 
-        if not dg_connection.is_connected:
-             print(f"Deepgram connection failed for {websocket.client}. Closing WebSocket.")
+    responder_task = asyncio.create_task(respond_to_utterances())
+
+    # In-flight image analyses, cancelled when the client goes away
+    analysis_tasks = set()
+
+    async def analyze_image(data_url: str):
+        try:
+            analysis_result = await run_gemini(analyze_image_from_data_url, data_url)
+
+            # Add the AI response to conversation context
+            conversation.add_ai_response(analysis_result)
+
+            # Send analysis back to client
+            send_json({
+                "type": "ai_response",
+                "text": f"Analysis of your image: {analysis_result}"
+            })
+
+            # Re-enable the analyze button on the client side
+            send_json({
+                "type": "command",
+                "action": "enable_analyze_button"
+            })
+
+        except Exception as e:
+            logger.error("Error analyzing image: %s", e)
+            send_json({
+                "type": "error",
+                "text": f"Error analyzing image: {str(e)}"
+            })
+
+    dg_connection = None
+
+    try:
+        logger.info("Establishing Deepgram connection for %s...", websocket.client)
+        dg_connection = await deepgram_pool.acquire(transcript_callback=send_transcript_to_client)
+
+        if not await dg_connection.wait_until_ready():
+             logger.error("Deepgram connection failed for %s. Closing WebSocket.", websocket.client)
              await websocket.close(code=1011, reason="Failed to connect to transcription service")
              return # Exit the endpoint
 
-        print(f"Deepgram connection ready for {websocket.client}.")
+        logger.info("Deepgram connection ready for %s.", websocket.client)
 
         while True:
             # Receive data from the client - could be audio bytes or a text message
@@ -141,56 +300,54 @@ async def websocket_endpoint(websocket: WebSocket):
             if "text" in message:
                 try:
                     text_data = message["text"]
-                    json_data = json.loads(text_data)
+                    json_data = orjson.loads(text_data)
                     
                     # Check if this is an image analysis request
                     if json_data.get("type") == "analyze_image" and "dataUrl" in json_data:
-                        print(f"Received image analysis request from {websocket.client}")
+                        logger.info("Received image analysis request from %s", websocket.client)
                         data_url = json_data["dataUrl"]
                         
-                        try:
-                            # Add the image to the conversation context
-                            conversation.add_image_message(data_url)
-                            
-                            # Process the image with Gemini API using our new function
-                            analysis_result = analyze_image_from_data_url(data_url)
-                            
-                            # Add the AI response to conversation context
-                            conversation.add_ai_response(analysis_result)
-                            
-                            # Send analysis back to client
-                            await websocket.send_text(json.dumps({
-                                "type": "ai_response",
-                                "text": f"Analysis of your image: {analysis_result}"
-                            }))
-                            
-                            # Re-enable the analyze button on the client side
-                            await websocket.send_text(json.dumps({
-                                "type": "command",
-                                "action": "enable_analyze_button"
-                            }))
-                            
-                        except Exception as e:
-                            print(f"Error analyzing image: {e}")
-                            await websocket.send_text(json.dumps({
-                                "type": "error",
-                                "text": f"Error analyzing image: {str(e)}"
-                            }))
+                        # Add the image to the conversation context
+                        conversation.add_image_message(data_url)
+
+                        # Analyze in the background so this loop keeps forwarding audio to Deepgram
+                        task = asyncio.create_task(analyze_image(data_url))
+                        analysis_tasks.add(task)
+                        task.add_done_callback(analysis_tasks.discard)
                 except Exception as e:
-                    print(f"Error processing text message: {e}")
+                    logger.error("Error processing text message: %s", e)
             
             # Handle audio data (for speech transcription)
             elif "bytes" in message:
                 data = message["bytes"]
-                print(f"Received audio chunk of size {len(data)} bytes from {websocket.client}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Received audio chunk of size %d bytes from %s", len(data), websocket.client)
                 await dg_connection.send_audio(data)
 
     except WebSocketDisconnect:
-        print(f"WebSocket client disconnected: {websocket.client}")
+        logger.info("WebSocket client disconnected: %s", websocket.client)
     except Exception as e:
-        print(f"An error occurred in WebSocket endpoint for {websocket.client}: {e}")
+        logger.error("An error occurred in WebSocket endpoint for %s: %s", websocket.client, e)
         await websocket.close(code=1011, reason=f"Server error: {e}") 
     finally:
-        print(f"Closing Deepgram connection for {websocket.client}...")
-        await dg_connection.finish()
-        print(f"Resources cleaned up for {websocket.client}.")
+        for task in analysis_tasks:
+            task.cancel()
+        responder_task.cancel()
+        sender_task.cancel()
+        logger.info("Closing Deepgram connection for %s...", websocket.client)
+        if dg_connection:
+            await dg_connection.finish()
+        logger.info("Resources cleaned up for %s.", websocket.client)
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # Each worker is a separate process with its own Deepgram pool, HTTP client and caches
+    uvicorn.run(
+        "src.main:app",
+        host=settings.host,
+        port=settings.port,
+        workers=settings.web_concurrency,
+        loop="auto", # uvloop where available
+        http="httptools",
+    )